@@ -1,12 +1,147 @@
+import math
+import subprocess
+import numba as nb
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, PillowWriter
+from matplotlib.animation import FFMpegWriter
+from matplotlib.collections import EllipseCollection
+from matplotlib.colors import to_rgba
+from PIL import Image
+
+# --------------------------
+# Compiled interference kernels
+# --------------------------
+
+# Everything below works in float32: the result only feeds an 8-bit colormap,
+# so single precision halves the memory traffic at no visible cost.
+
+# Size of the interference grid
+NX, NY = 200, 150
+
+@nb.njit('f4(f4)', fastmath=True, cache=True)
+def _pow03(x):
+    # x**0.3 as a single log/exp pair, which fastmath lets LLVM vectorize
+    if x <= 0:
+        return np.float32(0)
+    return math.exp(np.float32(0.3) * math.log(x))
+
+
+@nb.guvectorize(['void(f4[:, :], f4[:], f4[:], f4, f4, f4[:])'],
+                '(x,w),(w),(w),(),()->(x)',
+                target='parallel', nopython=True, fastmath=True, cache=True)
+def _intensity(dx2, dy2, lag, damping, k, out):
+    # Sum the damped circular waves at every point of one grid row and store
+    # |Z|^0.6 in out, i.e. the intensity with the power-law contrast scaling
+    # already applied. dx2[i, w] and dy2[w] are the squared x and y offsets
+    # from wave w, so the distance is a single add and sqrt, and lag[w] is the
+    # phase lag the wave accumulated since emission. Only visible waves are
+    # passed in, so the wave loop is branch-free. Called with one dy2 row per
+    # grid row, the parallel target spreads the rows over all cores.
+    r0 = np.float32(0.1)  # keeps the amplitude finite at the wave center
+    for i in range(dx2.shape[0]):
+        re = np.float32(0)
+        im = np.float32(0)
+        for w in range(dx2.shape[1]):
+            r = math.sqrt(dx2[i, w] + dy2[w])
+            amp = math.exp(-damping * r) / (r + r0)
+            # exp(1j*phase) as an adjacent sin/cos pair of the same argument,
+            # which LLVM can lower to a single sincos call
+            phase = k * r - lag[w]
+            s = math.sin(phase)
+            c = math.cos(phase)
+            re += amp * c
+            im += amp * s
+        out[i] = _pow03(re * re + im * im)
+
+
+@nb.njit('void(f4[:, :])', fastmath=True, cache=True)
+def _normalize(I):
+    # Normalize the scaled intensity to [0, 1]
+    peak = np.float32(0)
+    for j in range(I.shape[0]):
+        for i in range(I.shape[1]):
+            if I[j, i] > peak:
+                peak = I[j, i]
+    I /= (peak + np.float32(1e-6))
+
+
+@nb.njit('void(u1[:, :, :], i8, i8, i8[:], i8[:], f4[:, :], u1[:, :], f4)',
+         parallel=True, fastmath=True, cache=True)
+def _blend_overlay(frame, row0, col0, iy, ix, I, lut, alpha):
+    # Alpha-blend the colormapped intensity into an RGBA frame buffer. Pixel
+    # (row0 + r, col0 + c) shows grid cell (iy[r], ix[c]), i.e. a nearest
+    # neighbour upsample; levels are quantized to the lut like matplotlib does.
+    for r in nb.prange(iy.shape[0]):
+        for c in range(ix.shape[0]):
+            level = min(int(I[iy[r], ix[c]] * 256), 255)
+            for ch in range(3):
+                dst = frame[row0 + r, col0 + c, ch]
+                frame[row0 + r, col0 + c, ch] = np.uint8(dst * (1 - alpha)
+                                                         + lut[level, ch] * alpha)
+
+# --------------------------
+# Frame capture
+# --------------------------
+
+class _GifSink:
+    # Encodes fixed-size RGBA frame buffers into a GIF without re-rendering the
+    # figure through savefig. Frames are piped to ffmpeg when it is available
+    # (palettegen/paletteuse run in native code), otherwise they are collected
+    # as Pillow images and saved in one go. Only public APIs are used; no
+    # matplotlib writer internals are touched.
+
+    def __init__(self, path, size, fps):
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.frames = []
+        self.proc = None
+        if FFMpegWriter.isAvailable():
+            w, h = size
+            self.proc = subprocess.Popen(
+                [FFMpegWriter.bin_path(), '-f', 'rawvideo', '-vcodec', 'rawvideo',
+                 '-s', f'{w}x{h}', '-pix_fmt', 'rgba', '-framerate', str(fps),
+                 '-loglevel', 'error', '-i', 'pipe:',
+                 '-filter_complex', 'split [a][b];[a] palettegen [p];[b][p] paletteuse',
+                 '-metadata', 'artist=Me', '-y', path],
+                stdin=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.proc is not None:
+            self.proc.kill()
+
+    def add(self, buf):
+        # Refuse buffers of the wrong size instead of silently misframing them
+        w, h = self.size
+        if buf.nbytes != w * h * 4:
+            raise ValueError(f"Frame buffer holds {buf.nbytes} bytes, "
+                             f"expected {w}x{h} RGBA pixels")
+        if self.proc is not None:
+            self.proc.stdin.write(buf)
+        else:
+            self.frames.append(Image.frombytes('RGBA', self.size, bytes(buf)).convert('RGB'))
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            if self.proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to write '{self.path}'")
+        else:
+            self.frames[0].save(self.path, save_all=True, append_images=self.frames[1:],
+                                duration=int(1000 / self.fps), loop=0)
 
 # --------------------------
 # Setup the figure and axes
 # --------------------------
 
-def simulation(v,c):
+def simulation(v,c, compute_every=2):
+    if compute_every < 1:
+        raise ValueError(f"compute_every must be at least 1, got {compute_every}")
     plt.style.use('dark_background')
     fig, ax = plt.subplots(figsize=(12, 8), dpi=100, facecolor='black')
     ax.set_facecolor('black')
@@ -24,29 +159,50 @@ def simulation(v,c):
     c_medium = 0.7               # Speed of light in medium (normalized, c_medium < 1)
     v_particle = 0.9             # Particle speed (must be > c_medium for Cherenkov radiation)
     theta = np.arccos(c_medium / v_particle)  # Cherenkov angle in radians
+    cos_t = math.cos(theta)
+    sin_t = math.sin(theta)
 
     # Refractive index (assuming speed of light in vacuum c=1)
     n_medium = 1 / c_medium
 
+    damping = 0.1       # Controls the spatial damping of waves
+    wavelength = 1.0    # Arbitrary wavelength scale
+    k0 = 2 * math.pi / wavelength  # Wavenumber
+    wave_speed = 0.1 * c_medium  # Propagation effect in phase
+
     # ------------------------------------
     # Global data holders
     # ------------------------------------
-    waves = []           # list of wavefronts: { 'center': (x,y), 'start_frame': frame, 'circle': Circle }
-    particle_trail = []  # store recent particle positions for tracing the path
+    # Wavefronts are stored as parallel arrays; slots [0, n_waves) are in use
+    # max_waves is only a safety cap: emitting every 5 frames and fading out
+    # after ~17 frames, at most 4 waves are ever live
+    max_waves = 32
+    centers_x = np.zeros(max_waves, dtype=np.float32)
+    centers_y = np.zeros(max_waves, dtype=np.float32)
+    start_frames = np.zeros(max_waves, dtype=np.int32)
+    radii = np.zeros(max_waves, dtype=np.float32)
+    alphas = np.zeros(max_waves, dtype=np.float32)
+    active_mask = np.zeros(max_waves, dtype=bool)
+    n_waves = 0
+    trail_len = 30       # number of recent particle positions kept for tracing the path
+    trail_buf = np.empty((trail_len, 2), dtype=np.float32)  # ring buffer of positions
+    trail_count = 0      # total positions written to trail_buf
     angle_lines = []     # holds the two dashed lines indicating the Cherenkov cone
 
     # ------------------------------------
     # Create interference grid for overlay
+    # (recomputed only every `compute_every` frames)
     # ------------------------------------
-    nx, ny = 200, 150
-    x_lin = np.linspace(-8, 8, nx)
-    y_lin = np.linspace(-6, 6, ny)
-    X, Y = np.meshgrid(x_lin, y_lin)
-    intensity = np.zeros_like(X)
+    nx, ny = NX, NY
+    x_lin = np.linspace(-8, 8, nx, dtype=np.float32)
+    y_lin = np.linspace(-6, 6, ny, dtype=np.float32)
+    intensity = np.zeros((ny, nx), dtype=np.float32)
 
-    # Use a blue colormap for interference overlay
-    intensity_img = ax.imshow(intensity, extent=[-8, 8, -6, 6], origin='lower',
-                            cmap='viridis', alpha=0.5, vmin=0, vmax=1)
+    # The overlay is not an imshow artist: each frame the intensity is mapped
+    # through this colormap table and blended straight into the frame buffer
+    overlay_lut = plt.get_cmap('viridis')(np.arange(256), bytes=True)[:, :3]
+    overlay_alpha = 0.5
+    ax.set_aspect('equal')  # square grid cells, as imshow would enforce
 
     # ------------------------------------
     # Create particle and trail display objects
@@ -55,6 +211,18 @@ def simulation(v,c):
                         markeredgewidth=2, label='Particle')
     trail, = ax.plot([], [], 'w-', alpha=0.4, linewidth=1)
 
+    # Dashed lines indicating the Cherenkov cone, moved along with the particle
+    line1, = ax.plot([], [], '--', color='cyan', alpha=0.5)
+    line2, = ax.plot([], [], '--', color='cyan', alpha=0.5)
+    angle_lines.extend([line1, line2])
+
+    # Subtle yellow circles for the wavefronts, drawn as a single collection
+    wave_color = to_rgba('yellow')
+    wavefronts = EllipseCollection([], [], 0, units='xy', offsets=np.empty((0, 2)),
+                                   offset_transform=ax.transData, facecolors='none',
+                                   edgecolors=wave_color, linewidths=1)
+    ax.add_collection(wavefronts)
+
     # ------------------------------------
     # Create static text annotation for simulation parameters 
     # ------------------------------------
@@ -72,48 +240,63 @@ def simulation(v,c):
     # ------------------------------------
     # Function to draw Cherenkov angle (cone) lines 
     # ------------------------------------
+    cone_length = 4
+
     def draw_angle_lines(x, y):
-        # Remove old angle lines
-        for line in angle_lines:
-            line.remove()
-        angle_lines.clear()
-        
-        cone_length = 4
         # Lines radiating from the particle at angles +theta and -theta relative to the x-axis.
-        x_top = x + cone_length * np.cos(theta)
-        y_top = y + cone_length * np.sin(theta)
-        x_bot = x + cone_length * np.cos(theta)
-        y_bot = y - cone_length * np.sin(theta)
+        x_top = x + cone_length * cos_t
+        y_top = y + cone_length * sin_t
+        x_bot = x + cone_length * cos_t
+        y_bot = y - cone_length * sin_t
         
-        line1, = ax.plot([x, x_top], [y, y_top], '--', color='cyan', alpha=0.5)
-        line2, = ax.plot([x, x_bot], [y, y_bot], '--', color='cyan', alpha=0.5)
-        angle_lines.extend([line1, line2])
+        line1.set_data([x, x_top], [y, y_top])
+        line2.set_data([x, x_bot], [y, y_bot])
 
     # ------------------------------------
     # Function to compute interference intensity over the grid
     # ------------------------------------
     def compute_intensity(frame_number):
-        damping = 0.1       # Controls the spatial damping of waves
-        wavelength = 1.0    # Arbitrary wavelength scale
-        wave_speed = 0.1 * c_medium  # Propagation effect in phase
-        
-        Z = np.zeros_like(X, dtype=complex)
-        for wave in waves:
-            cx, cy = wave['center']
-            # Only incorporate waves within view
-            if cx < -8 or cx > 8 or cy < -6 or cy > 6:
-                continue
-            age = frame_number - wave['start_frame']
-            r = np.sqrt((X - cx)**2 + (Y - cy)**2)
-            amplitude = np.exp(-damping * r) / (r + 0.1)
-            phase = 2 * np.pi * (r - age * wave_speed) / wavelength
-            Z += amplitude * np.exp(1j * phase)
-        
-        I = np.abs(Z)**2
-        # Use a nonlinear scaling (power-law) for high contrast in interference features
-        I_norm = np.power(I, 0.3)
-        I_norm /= (I_norm.max() + 1e-6)
-        return I_norm
+        age = (frame_number - start_frames[:n_waves]).astype(np.float32)
+        cx, cy = centers_x[:n_waves], centers_y[:n_waves]
+        # Only incorporate waves within view
+        visible = ((cx >= -8) & (cx <= 8) & (cy >= -6) & (cy <= 6)
+                   & active_mask[:n_waves])
+        cx, cy, age = cx[visible], cy[visible], age[visible]
+        dx2 = np.square(x_lin[:, np.newaxis] - cx)
+        dy2 = np.square(y_lin[:, np.newaxis] - cy)
+        lag = np.float32(k0 * wave_speed) * age
+        _intensity(dx2, dy2, lag, damping, k0, out=intensity)
+        _normalize(intensity)
+        return intensity
+
+    # ------------------------------------
+    # Function to pack the active waves into the leading slots
+    # ------------------------------------
+    def compact():
+        nonlocal n_waves
+        keep = np.flatnonzero(active_mask[:n_waves])
+        if len(keep) == n_waves:
+            return  # nothing was culled, the slots are already packed
+        for arr in (centers_x, centers_y, start_frames, radii, alphas):
+            arr[:len(keep)] = arr[keep]
+        n_waves = len(keep)
+        active_mask[:n_waves] = True
+        active_mask[n_waves:] = False
+
+    # ------------------------------------
+    # Function to add a wave to the buffers
+    # ------------------------------------
+    def emit_wave(x, y, frame):
+        nonlocal n_waves
+        if n_waves == max_waves:
+            # The buffers are full of live waves: drop the oldest to make room
+            active_mask[0] = False
+            compact()
+        centers_x[n_waves] = x
+        centers_y[n_waves] = y
+        start_frames[n_waves] = frame
+        active_mask[n_waves] = True
+        n_waves += 1
 
     # ------------------------------------
     # Initialization function for the animation
@@ -121,70 +304,111 @@ def simulation(v,c):
     def init():
         particle.set_data([], [])
         trail.set_data([], [])
-        intensity_img.set_array(np.zeros_like(X))
-        return [particle, trail, intensity_img, params_text] + angle_lines
+        for line in angle_lines:
+            line.set_data([], [])
+        intensity[:] = 0
+        wavefronts.set_offsets(np.empty((0, 2)))
+        return [particle, trail, params_text, wavefronts] + angle_lines
 
     # ------------------------------------
     # Main animation function
     # ------------------------------------
     def animate(frame):
+        nonlocal n_waves, trail_count
         # Particle moving in a straight horizontal line (y=0)
         x = frame * 0.1 - 4  # Adjust speed and initial offset as needed
         y = 0
         particle.set_data([x], [y])
         
-        # Update particle trail (last 30 positions)
-        particle_trail.append((x, y))
-        if len(particle_trail) > 30:
-            particle_trail.pop(0)
-        xs, ys = zip(*particle_trail)
-        trail.set_data(xs, ys)
+        # Update particle trail (last trail_len positions, oldest first)
+        trail_buf[trail_count % trail_len] = (x, y)
+        trail_count += 1
+        idx = np.arange(max(0, trail_count - trail_len), trail_count) % trail_len
+        trail.set_data(trail_buf[idx, 0], trail_buf[idx, 1])
         
         # Update the Cherenkov cone lines relative to the current particle position
         draw_angle_lines(x, y)
         
         # Every 5 frames, emit a new wave (if particle is on screen)
         if frame % 5 == 0 and -8 <= x <= 8:
-            new_wave = {'center': (x, y), 'start_frame': frame}
-            # Draw a subtle yellow circle for the wavefront (low alpha)
-            circle = plt.Circle((x, y), 0.1, fill=False, edgecolor='yellow',
-                                alpha=0.2, linewidth=1)
-            ax.add_patch(circle)
-            new_wave['circle'] = circle
-            waves.append(new_wave)
+            emit_wave(x, y, frame)
         
-        # Update existing waves: expand the circles and fade them out
-        for wave in waves.copy():
-            age = frame - wave['start_frame']
-            radius = 0.1 + age * 0.1 * c_medium
-            if 'circle' in wave:
-                wave['circle'].set_radius(radius)
-                new_alpha = max(0, 0.2 - age * 0.01)
-                wave['circle'].set_alpha(new_alpha)
-                cx, cy = wave['center']
-                if new_alpha <= 0.03 or cx < -10 or cx > 10 or cy < -8 or cy > 8:
-                    wave['circle'].remove()
-                    waves.remove(wave)
+        # Update existing waves: expand the circles, fade them out and drop
+        # the faint or far off-screen ones
+        live = slice(0, n_waves)
+        age = frame - start_frames[live]
+        radii[live] = 0.1 + age * 0.1 * c_medium
+        fade = np.maximum(0, 0.2 - age * 0.01)
+        alphas[live] = fade
+        active_mask[live] &= ((fade > 0.03) & (np.abs(centers_x[live]) <= 10)
+                              & (np.abs(centers_y[live]) <= 8))
+        compact()
+
+        # Push all wavefront circles to the collection in one go
+        diameters = 2 * radii[:n_waves]
+        edgecolors = np.tile(wave_color, (n_waves, 1))
+        edgecolors[:, 3] = alphas[:n_waves]
+        wavefronts.set_offsets(np.column_stack([centers_x[:n_waves], centers_y[:n_waves]]))
+        wavefronts.set_widths(diameters)
+        wavefronts.set_heights(diameters)
+        wavefronts.set_edgecolor(edgecolors)
         
-        # Compute and update the interference intensity overlay
-        I_norm = compute_intensity(frame)
-        intensity_img.set_array(I_norm)
+        # Compute the interference intensity overlay; in between, the overlay
+        # keeps showing the last computed intensity
+        if frame % compute_every == 0:
+            compute_intensity(frame)
         
         # Return all animated objects
-        return [particle, trail, intensity_img, params_text] + angle_lines + \
-            [w['circle'] for w in waves if 'circle' in w]
+        return [particle, trail, params_text, wavefronts] + angle_lines
 
     # ------------------------------------
     # Create and save the animation
     # ------------------------------------
-    anim = FuncAnimation(fig, animate, init_func=init, frames=200,
-                        interval=30, blit=True)
+    n_frames = 200
 
-    writer = PillowWriter(fps=30, metadata=dict(artist='Me'))
     print("Saving animation...")
-    anim.save('cherenkov_radiation.gif', writer=writer,
-            savefig_kwargs={'facecolor': 'black'},
-            progress_callback=lambda i, n: print(f'Saving frame {i} of {n}'))
+    # Render the static parts of the figure (axes, ticks, labels) once and keep
+    # them as a background bitmap. Each frame restores that bitmap, blends in
+    # the intensity overlay with a compiled kernel and draws the gridlines, the
+    # axes spines and the animated artists on top, in z-order. The gridlines
+    # and spines sit above the overlay, so they are left out of the background.
+    animated = init()
+    for artist in animated:
+        artist.set_animated(True)
+    overlaid = (ax.xaxis.get_gridlines() + ax.yaxis.get_gridlines()
+                + list(ax.spines.values()))
+    for artist in overlaid:
+        artist.set_visible(False)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    for artist in overlaid:
+        artist.set_visible(True)
+    # Frames are sized in physical pixels, i.e. what the canvas buffer holds
+    # (larger than figsize * dpi on HiDPI canvases)
+    frame_size = fig.canvas.get_width_height(physical=True)
+
+    # Pixel footprint of the data area in the frame buffer (rows run top
+    # down) and the grid cell shown by each of its pixel rows and columns
+    height = np.asarray(fig.canvas.buffer_rgba()).shape[0]
+    x0, y0, x1, y1 = np.round(ax.bbox.extents).astype(int)
+    row0, col0 = height - y1, x0
+    y_px = y1 - 0.5 - np.arange(y1 - y0)
+    x_px = x0 + 0.5 + np.arange(x1 - x0)
+    iy = np.clip(((y_px - ax.bbox.y0) / ax.bbox.height * ny).astype(int), 0, ny - 1)
+    ix = np.clip(((x_px - ax.bbox.x0) / ax.bbox.width * nx).astype(int), 0, nx - 1)
+
+    with _GifSink('cherenkov_radiation.gif', frame_size, fps=30) as sink:
+        for frame in range(n_frames):
+            fig.canvas.restore_region(background)
+            artists = animate(frame)
+            _blend_overlay(np.asarray(fig.canvas.buffer_rgba()), row0, col0, iy, ix,
+                           intensity, overlay_lut, overlay_alpha)
+            for artist in overlaid:
+                ax.draw_artist(artist)
+            for artist in sorted(artists, key=lambda a: a.get_zorder()):
+                ax.draw_artist(artist)
+            sink.add(fig.canvas.buffer_rgba())
+            print(f'Saving frame {frame} of {n_frames}')
     print("Animation saved as 'cherenkov_radiation.gif'")
 
     plt.close()